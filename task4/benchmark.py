@@ -0,0 +1,182 @@
+# Бенчмарк реализаций Storage без запуска Kivy.
+#
+# Пример:
+#   python benchmark.py --sizes 1000 10000 100000 1000000 --output bench.json
+#
+# Пиковая память измеряется через tracemalloc, поэтому учитываются только
+# аллокации Python: собственный кэш страниц SQLite в нее не попадает.
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from storage import SQLiteStorage, FileStorage, JournalStorage
+
+BACKENDS = {
+    "sqlite": (SQLiteStorage, "notes.db"),
+    "file": (FileStorage, "notes.json"),
+    "journal": (JournalStorage, "notes.journal"),
+}
+
+SYLLABLES = ["ка", "ро", "ми", "на", "те", "ло", "ви", "да", "зе", "пу", "ша", "гор", "сон", "лес", "вет"]
+VOCABULARY_SIZE = 5000
+# Редкое слово подмешивается в малую долю заметок для избирательного поиска
+SELECTIVE_QUERY = "квазар"
+SELECTIVE_RATE = 0.001
+
+
+def make_vocabulary(rng):
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))))
+    return sorted(words, key=len)
+
+
+def generate_notes(count, seed=0):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    # Частоты слов по закону Ципфа: короткие слова встречаются чаще
+    cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(vocabulary) + 1)))
+    start = datetime(2020, 1, 1)
+
+    for i in range(count):
+        # Длины заголовка и текста в словах - логнормальные с длинным хвостом
+        title_length = max(1, int(rng.lognormvariate(1.1, 0.5)))
+        content_length = max(1, int(rng.lognormvariate(3.6, 1.0)))
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=title_length + content_length)
+        if rng.random() < SELECTIVE_RATE:
+            words[rng.randrange(len(words))] = SELECTIVE_QUERY
+        moment = start + timedelta(minutes=i * 7)
+        yield {
+            "title": " ".join(words[:title_length]).capitalize(),
+            "content": " ".join(words[title_length:]),
+            "date": moment.strftime("%Y-%m-%d"),
+            "time": moment.strftime("%H:%M"),
+        }
+
+
+def broad_query():
+    return make_vocabulary(random.Random(0))[0]
+
+
+def measure(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    # Отдельный прогон под tracemalloc, чтобы его накладные расходы не искажали время
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "repeat": repeat,
+        "median_ms": statistics.median(timings) * 1000,
+        "min_ms": min(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "peak_kb": peak / 1024,
+    }
+
+
+def bench_backend(name, size, repeat, workdir, seed):
+    storage_class, file_name = BACKENDS[name]
+    path = os.path.join(workdir, f"{name}-{size}-{file_name}")
+    results = {}
+
+    storage = storage_class(path)
+    started = time.perf_counter()
+    storage.import_notes(generate_notes(size, seed))
+    results["bulk_import"] = {"repeat": 1, "median_ms": (time.perf_counter() - started) * 1000}
+    results["file_size_kb"] = os.path.getsize(path) / 1024
+
+    rng = random.Random(seed + 1)
+    ids = [note["id"] for note in storage.iter_notes()]
+    rng.shuffle(ids)
+    update_ids = iter(ids)
+    delete_ids = iter(reversed(ids))
+    query = broad_query()
+
+    operations = [
+        # Конструкторы ленивые по-разному, поэтому открытие замеряется до первой страницы
+        ("open", lambda: storage_class(path).load_notes_page()),
+        ("load_notes", storage.load_notes),
+        ("load_notes_page", storage.load_notes_page),
+        ("save_note_insert", lambda: storage.save_note({"title": "Новая заметка", "content": "Текст " * 40})),
+        ("save_note_update", lambda: storage.save_note(
+            {"id": next(update_ids), "title": "Обновлено", "content": "Новый текст " * 30})),
+        ("delete_note", lambda: storage.delete_note(next(delete_ids))),
+        ("get_note", lambda: storage.get_note(ids[rng.randrange(len(ids) // 2)])),
+        ("search_notes_selective", lambda: storage.search_notes(SELECTIVE_QUERY)),
+        ("search_notes_broad", lambda: storage.search_notes(query)),
+        ("search_notes_page_selective", lambda: storage.search_notes_page(SELECTIVE_QUERY)),
+        ("search_notes_page_broad", lambda: storage.search_notes_page(query)),
+    ]
+    for operation, func in operations:
+        results[operation] = measure(func, repeat)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк хранилищ заметок")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="количество заметок в наборах")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=sorted(BACKENDS),
+                        help="проверяемые хранилища")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов каждой операции")
+    parser.add_argument("--seed", type=int, default=0, help="зерно генератора заметок")
+    parser.add_argument("--output", help="файл для JSON-результатов (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "seed": args.seed,
+        "results": [],
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            for name in args.backends:
+                print(f"{name}: {size} заметок...", file=sys.stderr)
+                report["results"].append({
+                    "backend": name,
+                    "notes": size,
+                    "operations": bench_backend(name, size, args.repeat, workdir, args.seed),
+                })
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
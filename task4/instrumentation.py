@@ -0,0 +1,80 @@
+import functools
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+
+class Profiler:
+    # Замеры пишутся в кольцевые буферы только при включенном профилировании;
+    # выключенный профилировщик стоит одну проверку флага на вызов.
+
+    def __init__(self, span_capacity=2000, frame_capacity=600):
+        self.enabled = False
+        self.spans = deque(maxlen=span_capacity)
+        self.frames = deque(maxlen=frame_capacity)
+
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record_span(name, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def record_span(self, name, duration):
+        self.spans.append((name, threading.current_thread().name, time.time(), duration))
+
+    def record_frame(self, duration):
+        if self.enabled:
+            self.frames.append((time.time(), duration))
+
+    def clear(self):
+        self.spans.clear()
+        self.frames.clear()
+
+    def summary(self):
+        spans = {}
+        for name, _, _, duration in list(self.spans):
+            stats = spans.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['total_ms'] += duration * 1000
+            stats['max_ms'] = max(stats['max_ms'], duration * 1000)
+        for stats in spans.values():
+            stats['avg_ms'] = stats['total_ms'] / stats['count']
+
+        durations = [duration for _, duration in list(self.frames)]
+        frames = {'count': len(durations)}
+        if durations:
+            average = sum(durations) / len(durations)
+            frames['avg_ms'] = average * 1000
+            frames['max_ms'] = max(durations) * 1000
+            frames['fps'] = 1 / average if average else 0.0
+        return {'spans': spans, 'frames': frames}
+
+    def export(self, path):
+        data = {
+            'exported_at': datetime.now().isoformat(timespec='seconds'),
+            'summary': self.summary(),
+            'spans': [
+                {'name': name, 'thread': thread, 'at': at, 'duration_ms': duration * 1000}
+                for name, thread, at, duration in list(self.spans)
+            ],
+            'frames': [
+                {'at': at, 'duration_ms': duration * 1000}
+                for at, duration in list(self.frames)
+            ],
+        }
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        return len(data['spans'])
+
+
+PROFILER = Profiler()
@@ -1,23 +1,49 @@
+import os
+import time
+
+
+def process_start_time():
+    # Момент старта процесса на часах perf_counter. На Linux и Android он
+    # берется из /proc, иначе отсчет идет от импорта main.py
+    now = time.perf_counter()
+    try:
+        with open('/proc/self/stat') as f:
+            # После имени процесса в скобках starttime - 20-е поле, в тиках
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        age = uptime - int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return now, "импорта main.py"
+    return now - age, "старта процесса"
+
+
+# Отсчет берется до импорта Kivy, см. NOTES_STARTUP_PROFILE
+START_TIME, START_LABEL = process_start_time()
+
+# Диалоги, меню и поле поиска импортируются при первом использовании,
+# классы из разметки KV KivyMD регистрирует в Factory сам
 from kivymd.app import MDApp
 from kivymd.uix.card import MDCard
-from kivymd.uix.list import MDList, OneLineListItem
-from kivymd.uix.scrollview import MDScrollView
-from kivymd.uix.toolbar import MDTopAppBar
-from kivymd.uix.dialog import MDDialog
-from kivymd.uix.button import MDFlatButton, MDRaisedButton
-from kivymd.uix.textfield import MDTextField
 from kivymd.uix.boxlayout import MDBoxLayout
-from kivymd.uix.menu import MDDropdownMenu
-from kivy.uix.screenmanager import ScreenManager, Screen
+from kivy.uix.screenmanager import Screen
+from kivy.uix.label import Label
 from kivy.properties import StringProperty, ObjectProperty, NumericProperty
 from kivy.clock import Clock
 from kivy.lang import Builder
+from kivy.logger import Logger
 
-import sqlite3
 import json
-import os
+import threading
 from datetime import datetime
-from abc import ABC, abstractmethod
+
+from instrumentation import PROFILER
+from storage import (SQLiteStorage, FileStorage, JournalStorage, WriteBehindQueue, EXPORT_PATH,
+                     make_preview, export_notes, import_notes_file, migrate_notes)
+
+SNAPSHOT_PATH = "first_screen.json"
+MAX_POOLED_ITEMS = 200
+STARTUP_PROFILE = os.environ.get("NOTES_STARTUP_PROFILE") == "1"
 
 KV = '''
 <NoteItem>:
@@ -57,6 +83,7 @@ KV = '''
     name: "main"
 
     MDBoxLayout:
+        id: main_layout
         orientation: "vertical"
 
         MDTopAppBar:
@@ -66,29 +93,10 @@ KV = '''
             left_action_items: [["menu", lambda x: root.show_menu(x)]]
             right_action_items: [["magnify", lambda x: root.toggle_search()]]
 
-        MDBoxLayout:
-            id: search_box
-            orientation: "horizontal"
-            adaptive_height: True
-            padding: "10dp"
-            spacing: "10dp"
-            height: 0
-            opacity: 0
-
-            MDTextField:
-                id: search_field
-                hint_text: "Поиск по заголовку и содержанию..."
-                mode: "round"
-                size_hint_x: 0.8
-                on_text: root.search_notes(self.text)
-
-            MDFlatButton:
-                text: "X"
-                theme_text_color: "Custom"
-                text_color: app.theme_cls.primary_color
-                on_release: root.clear_search()
-
         MDScrollView:
+            id: notes_scroll
+            on_scroll_y: root.on_notes_scroll(self)
+
             MDList:
                 id: notes_list
 
@@ -98,7 +106,47 @@ KV = '''
             md_bg_color: app.theme_cls.primary_color
             pos_hint: {"right": 0.95, "bottom": 0.05}
             on_release: root.add_note()
+'''
+
+# Редко используемые части разметки компилируются при первом обращении
+LAZY_KV = {
+    "search": '''
+<SearchBox>:
+    orientation: "horizontal"
+    size_hint_y: None
+    height: "80dp"
+    padding: "10dp"
+    spacing: "10dp"
 
+    MDTextField:
+        id: search_field
+        hint_text: "Поиск по заголовку и содержанию..."
+        mode: "round"
+        size_hint_x: 0.8
+        on_text: root.screen.search_notes(self.text)
+
+    MDFlatButton:
+        text: "X"
+        theme_text_color: "Custom"
+        text_color: app.theme_cls.primary_color
+        on_release: root.screen.clear_search()
+''',
+    "perf": '''
+<PerfOverlay>:
+    size_hint: None, None
+    size: self.texture_size
+    padding: "8dp", "8dp"
+    pos_hint: {"x": 0, "top": 0.9}
+    color: 1, 1, 1, 1
+    font_size: "11sp"
+    canvas.before:
+        Color:
+            rgba: 0, 0, 0, 0.7
+        Rectangle:
+            pos: self.pos
+            size: self.size
+''',
+    "dialog": '''
 <NoteDialogContent>:
     orientation: "vertical"
     spacing: "15dp"
@@ -119,176 +167,14 @@ KV = '''
         multiline: True
         size_hint_y: None
         height: "200dp"
-'''
-
-Builder.load_string(KV)
-
-class Storage(ABC):
-    @abstractmethod
-    def load_notes(self):
-        pass
-
-    @abstractmethod
-    def save_note(self, note):
-        pass
-
-    @abstractmethod
-    def delete_note(self, note_id):
-        pass
-
-    @abstractmethod
-    def search_notes(self, query):
-        pass
-
-class SQLiteStorage(Storage):
-    def __init__(self, db_path="notes.db"):
-        self.db_path = db_path
-        self.init_db()
-
-    def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-                       CREATE TABLE IF NOT EXISTS notes
-                       (
-                           id
-                           INTEGER
-                           PRIMARY
-                           KEY
-                           AUTOINCREMENT,
-                           title
-                           TEXT
-                           NOT
-                           NULL,
-                           content
-                           TEXT
-                           NOT
-                           NULL,
-                           date
-                           TEXT
-                           NOT
-                           NULL,
-                           time
-                           TEXT
-                           NOT
-                           NULL
-                       )
-                       ''')
-        conn.commit()
-        conn.close()
-
-    def load_notes(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM notes ORDER BY date DESC, time DESC")
-        notes = [{
-            'id': row[0],
-            'title': row[1],
-            'content': row[2],
-            'date': row[3],
-            'time': row[4]
-        } for row in cursor.fetchall()]
-        conn.close()
-        return notes
-
-    def save_note(self, note):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        if note.get('id'):
-            cursor.execute('''
-                           UPDATE notes
-                           SET title=?,
-                               content=?
-                           WHERE id = ?
-                           ''', (note['title'], note['content'], note['id']))
-        else:
-            now = datetime.now()
-            current_date = now.strftime("%Y-%m-%d")
-            current_time = now.strftime("%H:%M")
-
-            cursor.execute('''
-                           INSERT INTO notes (title, content, date, time)
-                           VALUES (?, ?, ?, ?)
-                           ''', (note['title'], note['content'], current_date, current_time))
-            note['id'] = cursor.lastrowid
-
-        conn.commit()
-        conn.close()
+''',
+}
+loaded_kv = set()
 
-    def delete_note(self, note_id):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM notes WHERE id=?", (note_id,))
-        conn.commit()
-        conn.close()
-
-    def search_notes(self, query):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-                       SELECT *
-                       FROM notes
-                       WHERE title LIKE ?
-                          OR content LIKE ?
-                       ORDER BY date DESC, time DESC
-                       ''', (f'%{query}%', f'%{query}%'))
-        notes = [{
-            'id': row[0],
-            'title': row[1],
-            'content': row[2],
-            'date': row[3],
-            'time': row[4]
-        } for row in cursor.fetchall()]
-        conn.close()
-        return notes
-
-class FileStorage(Storage):
-    def __init__(self, file_path="notes.json"):
-        self.file_path = file_path
-        self.init_storage()
-
-    def init_storage(self):
-        if not os.path.exists(self.file_path):
-            with open(self.file_path, 'w') as f:
-                json.dump([], f)
-
-    def load_notes(self):
-        try:
-            with open(self.file_path, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return []
-
-    def save_note(self, note):
-        notes = self.load_notes()
-
-        if note.get('id'):
-            for i, n in enumerate(notes):
-                if n['id'] == note['id']:
-                    notes[i]['title'] = note['title']
-                    notes[i]['content'] = note['content']
-                    break
-        else:
-            now = datetime.now()
-            note['id'] = max([n['id'] for n in notes], default=0) + 1
-            note['date'] = now.strftime("%Y-%m-%d")
-            note['time'] = now.strftime("%H:%M")
-            notes.append(note)
-
-        with open(self.file_path, 'w') as f:
-            json.dump(notes, f, indent=2)
-
-    def delete_note(self, note_id):
-        notes = self.load_notes()
-        notes = [n for n in notes if n['id'] != note_id]
-        with open(self.file_path, 'w') as f:
-            json.dump(notes, f, indent=2)
-
-    def search_notes(self, query):
-        notes = self.load_notes()
-        return [n for n in notes if query.lower() in n['title'].lower() or
-                query.lower() in n['content'].lower()]
+def load_kv(name):
+    if name not in loaded_kv:
+        Builder.load_string(LAZY_KV[name])
+        loaded_kv.add(name)
 
 class NoteItem(MDCard):
     note_title = StringProperty("")
@@ -301,22 +187,174 @@ class NoteItem(MDCard):
 class NoteDialogContent(MDBoxLayout):
     pass
 
+class PerfOverlay(Label):
+    pass
+
+class SearchBox(MDBoxLayout):
+    screen = ObjectProperty(None)
+
+class DialogPool:
+    # Каждый вид диалога создается один раз; при повторном показе меняются
+    # только заголовок, текст и обработчики кнопок.
+    # build(handle) должен строить кнопки, вызывающие handle(номер кнопки);
+    # обработчик кнопки получает сам диалог.
+
+    def __init__(self):
+        self.dialogs = {}
+        self.handlers = {}
+
+    def get(self, name, build):
+        dialog = self.dialogs.get(name)
+        if dialog is None:
+            dialog = build(lambda index: self.handle(name, index))
+            # MDDialog берет высоту контейнера в on_open, до того как подписи
+            # с новым текстом пересчитаны, и остается высотой прежнего текста
+            dialog.ids.container.bind(height=lambda container, height: setattr(dialog, 'height', height))
+            self.dialogs[name] = dialog
+        return dialog
+
+    def show(self, name, build, title, text=None, handlers=()):
+        dialog = self.get(name, build)
+        self.handlers[name] = handlers
+        dialog.title = title
+        if text is not None:
+            dialog.text = text
+        dialog.open()
+        return dialog
+
+    def handle(self, name, index):
+        self.handlers[name][index](self.dialogs[name])
+
+class NoteItemPool:
+    def __init__(self, on_tap):
+        self.on_tap = on_tap
+        self.free = []
+
+    def acquire(self, note):
+        if self.free:
+            item = self.free.pop()
+        else:
+            item = NoteItem()
+            item.bind(on_touch_down=self.on_tap)
+        item.note_title = note['title']
+        item.note_content = note['preview']
+        item.note_date = note['date']
+        item.note_time = note['time']
+        item.note_id = note['id'] or 0
+        item.note_data = note
+        return item
+
+    def release(self, items):
+        for item in items:
+            item.note_data = None
+            if len(self.free) < MAX_POOLED_ITEMS:
+                self.free.append(item)
+
 class MainScreen(Screen):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        self.storage = SQLiteStorage()
+        # Хранилище открывается в фоне, до этого на экране снимок первой страницы
+        self.storage = None
+        self.storage_type = None
+        self.persistence = None
+        # Закрытые очереди прежних хранилищ, которые еще могут дописывать правки
+        self.retired_queues = []
+        self.search_box = None
+        # Пока идет перенос, правки, поиск и меню недоступны
+        self.transferring = False
         self.selected_note = None
         self.menu = None
-        self.dialog = None
+        self.dialogs = DialogPool()
+        self.note_items = NoteItemPool(self.on_note_tap)
+        self.perf_overlay = None
+        self.current_query = ""
+        self.next_cursor = None
+        self.list_generation = 0
+        self.page_loading = False
+        self.report_startup("первый кадр")
         Clock.schedule_once(self.init_ui)
 
     def init_ui(self, dt):
-        self.load_notes()
-        self.create_menu()
-        self.ids.search_box.height = 0
-        self.ids.search_box.opacity = 0
+        self.show_snapshot()
+        threading.Thread(target=self.open_storage, daemon=True).start()
+
+    def open_storage(self):
+        # Если SQLite не открывается, работаем с файловым хранилищем
+        errors = []
+        for storage_type in ("sqlite", "file"):
+            try:
+                storage = self.create_storage(storage_type)
+                notes, next_cursor = storage.load_notes_page()
+            except Exception as e:
+                errors.append(f"{storage_type}: {str(e)}")
+                continue
+            Clock.schedule_once(lambda dt: self.on_storage_opened(storage, storage_type, notes, next_cursor, errors))
+            return
+
+        Clock.schedule_once(lambda dt: self.on_storage_failed(errors))
+
+    def on_storage_opened(self, storage, storage_type, notes, next_cursor, errors):
+        if self.storage_chosen():
+            return
+        self.use_storage(storage, storage_type)
+        self.current_query = ""
+        self.next_cursor = next_cursor
+        self.clear_note_items()
+        for note in notes:
+            self.add_note_item(note)
+        self.save_snapshot(notes)
+        self.report_startup("хранилище открыто")
+        if errors:
+            self.show_toast(f"Ошибка открытия хранилища ({'; '.join(errors)}), используется {storage_type} хранилище")
+
+    def on_storage_failed(self, errors):
+        if self.storage_chosen():
+            return
+        # Снимок не должен выглядеть как рабочий список: правки в него некуда сохранить
+        self.clear_note_items()
+        self.show_toast(f"Ошибка открытия хранилища: {'; '.join(errors)}. Выберите хранилище в меню")
+
+    def storage_chosen(self):
+        # Пока хранилище открывалось в фоне, его могли выбрать в меню:
+        # выбор пользователя важнее результата запуска
+        return self.storage is not None or self.transferring
+
+    def show_snapshot(self):
+        try:
+            with open(SNAPSHOT_PATH, 'r', encoding='utf-8') as f:
+                notes = json.load(f)
+        except (OSError, ValueError):
+            return
+        for note in notes:
+            self.add_note_item(note)
+        self.report_startup("снимок на экране")
+
+    def save_snapshot(self, notes):
+        if self.storage_type != "sqlite":
+            return
+        tmp_path = SNAPSHOT_PATH + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(notes, f, ensure_ascii=False)
+            os.replace(tmp_path, SNAPSHOT_PATH)
+        except OSError:
+            pass
+
+    def report_startup(self, stage):
+        # Этап засчитывается, когда кадр с ним выведен на экран
+        if not STARTUP_PROFILE:
+            return
+        from kivy.core.window import Window
+
+        def on_flip(window):
+            Window.unbind(on_flip=on_flip)
+            Logger.info(f"Startup: {stage} через {(time.perf_counter() - START_TIME) * 1000:.0f} мс от {START_LABEL}")
+
+        Window.bind(on_flip=on_flip)
 
     def create_menu(self):
+        from kivymd.uix.menu import MDDropdownMenu
+
         menu_items = [
             {
                 "text": "SQLite хранилище",
@@ -328,6 +366,46 @@ class MainScreen(Screen):
                 "viewclass": "OneLineListItem",
                 "on_release": lambda: self.switch_storage("file"),
             },
+            {
+                "text": "Журнальное хранилище",
+                "viewclass": "OneLineListItem",
+                "on_release": lambda: self.switch_storage("journal"),
+            },
+            {
+                "text": "Перенести заметки в SQLite",
+                "viewclass": "OneLineListItem",
+                "on_release": lambda: self.migrate_storage("sqlite"),
+            },
+            {
+                "text": "Перенести заметки в файл",
+                "viewclass": "OneLineListItem",
+                "on_release": lambda: self.migrate_storage("file"),
+            },
+            {
+                "text": "Перенести заметки в журнал",
+                "viewclass": "OneLineListItem",
+                "on_release": lambda: self.migrate_storage("journal"),
+            },
+            {
+                "text": "Экспорт в JSON",
+                "viewclass": "OneLineListItem",
+                "on_release": lambda: self.export_notes(),
+            },
+            {
+                "text": "Импорт из JSON",
+                "viewclass": "OneLineListItem",
+                "on_release": lambda: self.import_notes(),
+            },
+            {
+                "text": "Монитор производительности",
+                "viewclass": "OneLineListItem",
+                "on_release": lambda: self.toggle_profiling(),
+            },
+            {
+                "text": "Экспорт метрик",
+                "viewclass": "OneLineListItem",
+                "on_release": lambda: self.export_metrics(),
+            },
         ]
         self.menu = MDDropdownMenu(
             items=menu_items,
@@ -335,48 +413,300 @@ class MainScreen(Screen):
         )
 
     def show_menu(self, button):
+        if self.wait_for_transfer():
+            return
+        if self.menu is None:
+            self.create_menu()
         self.menu.caller = button
         self.menu.open()
 
-    def switch_storage(self, storage_type):
+    def create_storage(self, storage_type):
         if storage_type == "sqlite":
-            self.storage = SQLiteStorage()
+            return SQLiteStorage()
+        elif storage_type == "journal":
+            return JournalStorage()
         else:
-            self.storage = FileStorage()
+            return FileStorage()
+
+    def use_storage(self, storage, storage_type):
+        if self.persistence:
+            # Старая очередь дописывает свои записи в фоне, до выхода
+            # из приложения ее нужно дождаться
+            self.persistence.close()
+            self.retired_queues = [queue for queue in self.retired_queues if queue.thread.is_alive()]
+            self.retired_queues.append(self.persistence)
+        self.storage = storage
+        self.storage_type = storage_type
+        self.persistence = WriteBehindQueue(storage, on_error=self.on_persistence_error)
+
+    def on_persistence_error(self, error):
+        # Вызывается из фонового потока очереди записи
+        message = f"Ошибка сохранения: {str(error)}"
+        Clock.schedule_once(lambda dt: self.show_persistence_error(message))
+
+    def show_persistence_error(self, message):
+        self.show_toast(message)
         self.load_notes()
+
+    def switch_storage(self, storage_type):
         self.menu.dismiss()
-        self.show_toast(f"Используется {storage_type} хранилище")
+
+        def done(storage):
+            self.use_storage(storage, storage_type)
+            self.load_notes()
+            self.show_toast(f"Используется {storage_type} хранилище")
+
+        # Хранилище открывается, только когда текущая очередь дописана:
+        # иначе новый экземпляр прочитал бы файл без ее правок и выдал
+        # повторные id или затер бы их при следующей записи
+        self.start_transfer("Открытие", lambda progress: self.create_storage(storage_type), done)
+
+    def migrate_storage(self, storage_type):
+        self.menu.dismiss()
+        if self.no_storage():
+            return
+        if storage_type == self.storage_type:
+            self.show_toast("Заметки уже в этом хранилище")
+            return
+
+        source = self.storage
+
+        def task(progress):
+            target = self.create_storage(storage_type)
+            count = migrate_notes(source, target, progress)
+            return target, count
+
+        def done(result):
+            target, count = result
+            self.use_storage(target, storage_type)
+            self.load_notes()
+            self.show_toast(f"Перенесено заметок: {count}")
+
+        self.start_transfer("Перенос", task, done)
+
+    def export_notes(self):
+        self.menu.dismiss()
+        if self.no_storage():
+            return
+        storage = self.storage
+        self.start_transfer(
+            "Экспорт",
+            lambda progress: export_notes(storage, EXPORT_PATH, progress),
+            lambda count: self.show_toast(f"Экспортировано заметок: {count}")
+        )
+
+    def import_notes(self):
+        self.menu.dismiss()
+        if self.no_storage():
+            return
+        if not os.path.exists(EXPORT_PATH):
+            self.show_toast(f"Файл {EXPORT_PATH} не найден")
+            return
+
+        storage = self.storage
+
+        def done(count):
+            self.load_notes()
+            self.show_toast(f"Импортировано заметок: {count}")
+
+        self.start_transfer(
+            "Импорт",
+            lambda progress: import_notes_file(storage, EXPORT_PATH, progress),
+            done
+        )
+
+    def start_transfer(self, title, task, on_done):
+        # Перенос идет в фоновом потоке, UI обновляется только через Clock
+        if self.wait_for_transfer():
+            return
+
+        def progress(count):
+            Clock.schedule_once(lambda dt: self.show_transfer_progress(title, count))
+
+        # Сброс поиска ставит чтение списка в очередь раньше переноса
+        if self.search_box and self.search_box.parent:
+            self.clear_search()
+        self.transferring = True
+        persistence = self.persistence
+        # Если хранилище не открылось при запуске, очереди еще нет
+        storage_lock = persistence.storage_lock if persistence else threading.Lock()
+
+        def worker():
+            try:
+                # Отложенные правки дописываются до переноса, новых не будет,
+                # пока он не закончится
+                if persistence:
+                    persistence.flush()
+                with storage_lock:
+                    result = task(progress)
+            except Exception as e:
+                message = f"Ошибка: {str(e)}"
+                Clock.schedule_once(lambda dt: self.finish_transfer(self.show_persistence_error, message))
+            else:
+                Clock.schedule_once(lambda dt: self.finish_transfer(on_done, result))
+
+        self.show_transfer_progress(title, 0)
+        threading.Thread(target=worker, daemon=True).start()
+
+    def show_transfer_progress(self, title, count):
+        self.ids.toolbar.title = f"{title}: {count}"
+
+    def finish_transfer(self, callback, result):
+        self.transferring = False
+        self.ids.toolbar.title = "Мои Заметки"
+        callback(result)
+
+    def no_storage(self):
+        if self.storage is None:
+            self.show_toast("Хранилище не открыто, выберите его в меню")
+        return self.storage is None
+
+    def wait_for_transfer(self):
+        if self.transferring:
+            self.show_toast("Дождитесь окончания переноса заметок")
+        return self.transferring
+
+    def queues(self):
+        if self.persistence:
+            return [self.persistence] + self.retired_queues
+        return list(self.retired_queues)
+
+    def toggle_profiling(self):
+        self.menu.dismiss()
+        if PROFILER.enabled:
+            PROFILER.enabled = False
+            Clock.unschedule(self.sample_frame)
+            Clock.unschedule(self.update_perf_overlay)
+            self.remove_widget(self.perf_overlay)
+            return
+
+        PROFILER.clear()
+        PROFILER.enabled = True
+        if self.perf_overlay is None:
+            load_kv("perf")
+            self.perf_overlay = PerfOverlay()
+        self.add_widget(self.perf_overlay)
+        Clock.schedule_interval(self.sample_frame, 0)
+        Clock.schedule_interval(self.update_perf_overlay, 0.5)
+
+    def sample_frame(self, dt):
+        PROFILER.record_frame(dt)
+
+    def update_perf_overlay(self, dt):
+        summary = PROFILER.summary()
+        frames = summary['frames']
+        lines = [f"FPS: {frames.get('fps', 0):.0f}  кадр max: {frames.get('max_ms', 0):.1f} мс"]
+        spans = sorted(summary['spans'].items(), key=lambda item: item[1]['total_ms'], reverse=True)
+        for name, stats in spans[:8]:
+            lines.append(f"{name}: {stats['count']}x, avg {stats['avg_ms']:.1f}, max {stats['max_ms']:.1f} мс")
+        self.perf_overlay.text = "\n".join(lines)
+
+    def export_metrics(self):
+        self.menu.dismiss()
+        path = f"perf_{datetime.now():%Y%m%d_%H%M%S}.json"
+        try:
+            count = PROFILER.export(path)
+            self.show_toast(f"Метрики сохранены в {path} (замеров: {count})")
+        except OSError as e:
+            self.show_toast(f"Ошибка экспорта: {str(e)}")
 
     def toggle_search(self):
-        search_box = self.ids.search_box
-        if search_box.height == 0:
-            search_box.height = 80
-            search_box.opacity = 1
-            self.ids.search_field.focus = True
+        if self.storage is None or self.wait_for_transfer():
+            return
+        if self.search_box is None:
+            load_kv("search")
+            self.search_box = SearchBox(screen=self)
+
+        if self.search_box.parent is None:
+            # Поле поиска встает сразу под панелью инструментов
+            layout = self.ids.main_layout
+            layout.add_widget(self.search_box, index=len(layout.children) - 1)
+            self.search_box.ids.search_field.focus = True
         else:
             self.clear_search()
 
+    @PROFILER.timed("MainScreen.load_notes")
     def load_notes(self):
+        self.show_first_page("", on_loaded=self.save_snapshot)
+
+    def show_first_page(self, query, on_loaded=None):
+        if self.transferring:
+            return
+        self.current_query = query
+        self.next_cursor = None
+        # Страницы, запрошенные для прежнего списка, будут отброшены
+        self.list_generation += 1
+        self.page_loading = False
+        self.clear_note_items()
+        self.ids.notes_scroll.scroll_y = 1
+        self.load_more_notes(on_loaded)
+
+    def load_more_notes(self, on_loaded=None):
+        # Страница читается потоком очереди записи после уже поставленных
+        # правок, поэтому они в нее попадают без flush на UI-потоке. Во время
+        # переноса хранилище занято им, список не перечитывается до его конца
+        if self.persistence is None or self.page_loading or self.transferring:
+            return
+        self.page_loading = True
+        generation = self.list_generation
+        query = self.current_query
+        cursor = self.next_cursor
+
+        def read(storage):
+            if query:
+                return storage.search_notes_page(query, cursor)
+            return storage.load_notes_page(cursor)
+
+        def loaded(result, error):
+            Clock.schedule_once(lambda dt: self.on_page_loaded(generation, result, error, on_loaded))
+
+        self.persistence.read(read, loaded)
+
+    @PROFILER.timed("MainScreen.on_page_loaded")
+    def on_page_loaded(self, generation, result, error, on_loaded):
+        if generation != self.list_generation:
+            return
+        self.page_loading = False
+        if error:
+            self.show_toast(f"Ошибка загрузки заметок: {str(error)}")
+            return
+
+        notes, self.next_cursor = result
+        # Заметку, добавленную пока страница читалась, список уже показывает
+        shown = {item.note_data.get('id') for item in self.ids.notes_list.children}
+        for note in notes:
+            if note['id'] not in shown:
+                self.add_note_item(note)
+        if on_loaded:
+            on_loaded(notes)
+
+    def on_notes_scroll(self, scroll_view):
+        # Подгружаем следующую страницу, когда список докручен почти до конца
+        if self.next_cursor and scroll_view.scroll_y <= 0.05:
+            self.load_more_notes()
+
+    def add_note_item(self, note, index=0):
+        self.ids.notes_list.add_widget(self.note_items.acquire(note), index=index)
+
+    def clear_note_items(self):
         notes_list = self.ids.notes_list
+        items = list(notes_list.children)
         notes_list.clear_widgets()
+        self.note_items.release(items)
 
-        notes = self.storage.load_notes()
-        for note in notes:
-            item = NoteItem(
-                note_title=note['title'],
-                note_content=note['content'][:150] + "..." if len(note['content']) > 150 else note['content'],
-                note_date=note['date'],
-                note_time=note['time'],
-                note_id=note['id'],
-                note_data=note
-            )
-            item.bind(
-                on_touch_down=lambda instance, touch, note_data=note: self.on_note_tap(instance, touch, note_data))
-            notes_list.add_widget(item)
-
-    def on_note_tap(self, instance, touch, note_data):
+    def find_note_item(self, note):
+        for item in self.ids.notes_list.children:
+            if item.note_data is note:
+                return item
+        return None
+
+    def on_note_tap(self, instance, touch):
+        if self.storage is None or instance.note_data is None:
+            return
         if instance.collide_point(*touch.pos) and touch.button == 'left':
-            self.selected_note = note_data
+            if self.wait_for_transfer():
+                return True
+            self.selected_note = instance.note_data
             self.show_action_dialog()
             return True
 
@@ -384,33 +714,47 @@ class MainScreen(Screen):
         if not self.selected_note:
             return
 
+        self.dialogs.show(
+            "action",
+            self.build_action_dialog,
+            title=f"Действия с заметкой: {self.selected_note['title'][:30]}...",
+            handlers=[
+                self.edit_note_action,
+                self.delete_note_action,
+                lambda dialog: dialog.dismiss(),
+            ]
+        )
+
+    def build_action_dialog(self, handle):
+        from kivymd.uix.button import MDFlatButton
+        from kivymd.uix.dialog import MDDialog
+
         app = MDApp.get_running_app()
         primary_color = app.theme_cls.primary_color
 
-        action_dialog = MDDialog(
-            title=f"Действия с заметкой: {self.selected_note['title'][:30]}...",
+        return MDDialog(
+            title=" ",
             buttons=[
                 MDFlatButton(
                     text="Редактировать",
                     theme_text_color="Custom",
                     text_color=primary_color,
-                    on_release=lambda x: self.edit_note_action(action_dialog)
+                    on_release=lambda x: handle(0)
                 ),
                 MDFlatButton(
                     text="Удалить",
                     theme_text_color="Custom",
                     text_color=app.theme_cls.error_color,
-                    on_release=lambda x: self.delete_note_action(action_dialog)
+                    on_release=lambda x: handle(1)
                 ),
                 MDFlatButton(
                     text="Отмена",
                     theme_text_color="Custom",
                     text_color=primary_color,
-                    on_release=lambda x: action_dialog.dismiss()
+                    on_release=lambda x: handle(2)
                 ),
             ],
         )
-        action_dialog.open()
 
     def edit_note_action(self, dialog):
         dialog.dismiss()
@@ -421,6 +765,8 @@ class MainScreen(Screen):
         self.delete_note()
 
     def add_note(self):
+        if self.storage is None or self.wait_for_transfer():
+            return
         self.selected_note = None
         self.show_note_dialog()
 
@@ -431,41 +777,70 @@ class MainScreen(Screen):
         self.show_note_dialog()
 
     def show_note_dialog(self):
-        content = NoteDialogContent()
+        if not self.selected_note:
+            self.open_note_dialog(None, {'title': "", 'content': ""}, None)
+            return
 
-        if self.selected_note:
-            content.ids.title_field.text = self.selected_note['title']
-            content.ids.content_field.text = self.selected_note['content']
-        else:
-            content.ids.title_field.text = ""
-            content.ids.content_field.text = ""
+        # В списке хранится только превью, полный текст читается потоком очереди
+        note_ref = self.selected_note
+        self.persistence.fetch_note(note_ref, lambda note, error: Clock.schedule_once(
+            lambda dt: self.open_note_dialog(note_ref, note, error)))
 
-        app = MDApp.get_running_app()
-        primary_color = app.theme_cls.primary_color
+    @PROFILER.timed("MainScreen.open_note_dialog")
+    def open_note_dialog(self, note_ref, note, error):
+        if note_ref is not self.selected_note:
+            return
+        if error:
+            self.show_toast(f"Ошибка чтения заметки: {str(error)}")
+            return
+        if note is None:
+            self.show_toast("Заметка не найдена")
+            return
 
-        self.dialog = MDDialog(
+        content = self.dialogs.get("note", self.build_note_dialog).content_cls
+        content.ids.title_field.text = note['title']
+        content.ids.content_field.text = note['content']
+
+        self.dialogs.show(
+            "note",
+            self.build_note_dialog,
             title="Редактировать заметку" if self.selected_note else "Новая заметка",
+            handlers=[
+                lambda dialog: dialog.dismiss(),
+                self.save_note,
+            ]
+        )
+
+    def build_note_dialog(self, handle):
+        from kivymd.uix.button import MDFlatButton, MDRaisedButton
+        from kivymd.uix.dialog import MDDialog
+
+        load_kv("dialog")
+        primary_color = MDApp.get_running_app().theme_cls.primary_color
+
+        return MDDialog(
+            title=" ",
             type="custom",
-            content_cls=content,
+            content_cls=NoteDialogContent(),
             buttons=[
                 MDFlatButton(
                     text="ОТМЕНА",
                     theme_text_color="Custom",
                     text_color=primary_color,
-                    on_release=lambda x: self.dialog.dismiss()
+                    on_release=lambda x: handle(0)
                 ),
                 MDRaisedButton(
                     text="СОХРАНИТЬ",
                     theme_text_color="Custom",
                     text_color=(1, 1, 1, 1),
                     md_bg_color=primary_color,
-                    on_release=lambda x: self.save_note(content)
+                    on_release=lambda x: handle(1)
                 ),
             ],
         )
-        self.dialog.open()
 
-    def save_note(self, content):
+    def save_note(self, dialog):
+        content = dialog.content_cls
         title = content.ids.title_field.text.strip()
         content_text = content.ids.content_field.text.strip()
 
@@ -477,103 +852,116 @@ class MainScreen(Screen):
             self.show_toast("Введите содержание заметки")
             return
 
-        note_data = {
-            'title': title,
-            'content': content_text
-        }
-
+        # Список обновляется сразу, запись в хранилище идет в фоне
         if self.selected_note:
-            note_data['id'] = self.selected_note['id']
+            note = self.selected_note
+        else:
+            now = datetime.now()
+            note = {'id': None, 'date': now.strftime("%Y-%m-%d"), 'time': now.strftime("%H:%M")}
+        note['title'] = title
+        note['content'] = content_text
+        note['preview'] = make_preview(content_text)
+        self.persistence.save(note)
+        dialog.dismiss()
 
-        try:
-            self.storage.save_note(note_data)
-            self.dialog.dismiss()
-            self.load_notes()
-            self.show_toast("Заметка сохранена")
-        except Exception as e:
-            self.show_toast(f"Ошибка сохранения: {str(e)}")
+        item = self.find_note_item(note)
+        if item:
+            item.note_title = note['title']
+            item.note_content = note['preview']
+        else:
+            self.add_note_item(note, index=len(self.ids.notes_list.children))
+        self.show_toast("Заметка сохранена")
 
     def delete_note(self):
         if not self.selected_note:
             self.show_toast("Сначала выберите заметку")
             return
 
-        app = MDApp.get_running_app()
-        primary_color = app.theme_cls.primary_color
-        error_color = app.theme_cls.error_color
-
-        confirm_dialog = MDDialog(
+        self.dialogs.show(
+            "confirm_delete",
+            self.build_confirm_dialog,
             title="Подтверждение удаления",
             text=f"Удалить заметку '{self.selected_note['title']}'?",
+            handlers=[
+                lambda dialog: dialog.dismiss(),
+                self.confirm_delete,
+            ]
+        )
+
+    def build_confirm_dialog(self, handle):
+        from kivymd.uix.button import MDFlatButton, MDRaisedButton
+        from kivymd.uix.dialog import MDDialog
+
+        app = MDApp.get_running_app()
+
+        return MDDialog(
+            title=" ",
+            text=" ",
             buttons=[
                 MDFlatButton(
                     text="ОТМЕНА",
                     theme_text_color="Custom",
-                    text_color=primary_color,
-                    on_release=lambda x: confirm_dialog.dismiss()
+                    text_color=app.theme_cls.primary_color,
+                    on_release=lambda x: handle(0)
                 ),
                 MDRaisedButton(
                     text="УДАЛИТЬ",
                     theme_text_color="Custom",
                     text_color=(1, 1, 1, 1),
-                    md_bg_color=error_color,
-                    on_release=lambda x: self.confirm_delete(confirm_dialog)
+                    md_bg_color=app.theme_cls.error_color,
+                    on_release=lambda x: handle(1)
                 ),
             ],
         )
-        confirm_dialog.open()
 
     def confirm_delete(self, dialog):
-        try:
-            self.storage.delete_note(self.selected_note['id'])
-            dialog.dismiss()
-            self.selected_note = None
-            self.load_notes()
-            self.show_toast("Заметка удалена")
-        except Exception as e:
-            self.show_toast(f"Ошибка удаления: {str(e)}")
+        self.persistence.delete(self.selected_note)
+        dialog.dismiss()
+        item = self.find_note_item(self.selected_note)
+        if item:
+            self.ids.notes_list.remove_widget(item)
+            self.note_items.release([item])
+        self.selected_note = None
+        self.show_toast("Заметка удалена")
 
+    @PROFILER.timed("MainScreen.search_notes")
     def search_notes(self, query):
+        if self.transferring:
+            return
         if not query.strip():
             self.load_notes()
             return
 
-        notes_list = self.ids.notes_list
-        notes_list.clear_widgets()
-
-        notes = self.storage.search_notes(query)
-        for note in notes:
-            item = NoteItem(
-                note_title=note['title'],
-                note_content=note['content'][:150] + "..." if len(note['content']) > 150 else note['content'],
-                note_date=note['date'],
-                note_time=note['time'],
-                note_id=note['id'],
-                note_data=note
-            )
-            item.bind(
-                on_touch_down=lambda instance, touch, note_data=note: self.on_note_tap(instance, touch, note_data))
-            notes_list.add_widget(item)
+        self.show_first_page(query)
 
     def clear_search(self):
-        self.ids.search_field.text = ""
+        self.search_box.ids.search_field.text = ""
         self.load_notes()
-        self.ids.search_box.height = 0
-        self.ids.search_box.opacity = 0
+        self.ids.main_layout.remove_widget(self.search_box)
 
     def show_toast(self, text):
-        toast_dialog = MDDialog(
+        self.dialogs.show(
+            "toast",
+            self.build_toast_dialog,
             title=text,
+            handlers=[lambda dialog: dialog.dismiss()]
+        )
+
+    def build_toast_dialog(self, handle):
+        from kivymd.uix.button import MDFlatButton
+        from kivymd.uix.dialog import MDDialog
+
+        return MDDialog(
+            title=" ",
             buttons=[
                 MDFlatButton(
                     text="OK",
                     theme_text_color="Custom",
                     text_color=MDApp.get_running_app().theme_cls.primary_color,
-                    on_release=lambda x: toast_dialog.dismiss()
+                    on_release=lambda x: handle(0)
                 ),
             ],
         )
-        toast_dialog.open()
 
 class NotesApp(MDApp):
     def __init__(self, **kwargs):
@@ -585,7 +973,19 @@ class NotesApp(MDApp):
         self.theme_cls.primary_palette = "Blue"
         self.theme_cls.material_style = "M3"
 
-        return MainScreen()
+        Builder.load_string(KV)
+        self.main_screen = MainScreen()
+        return self.main_screen
+
+    def on_pause(self):
+        # На Android приложение может быть выгружено без on_stop
+        for queue in self.main_screen.queues():
+            queue.flush()
+        return True
+
+    def on_stop(self):
+        for queue in self.main_screen.queues():
+            queue.stop()
 
 if __name__ == "__main__":
     NotesApp().run()
\ No newline at end of file
@@ -0,0 +1,1033 @@
+import sqlite3
+import json
+import os
+import bisect
+import itertools
+import threading
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from abc import ABC, abstractmethod
+
+from instrumentation import PROFILER
+
+PAGE_SIZE = 30
+PREVIEW_LENGTH = 150
+TRANSFER_BATCH_SIZE = 500
+EXPORT_PATH = "notes_export.json"
+
+def note_key(note):
+    return note['date'], note['time'], note['id']
+
+def make_preview(content):
+    return content[:PREVIEW_LENGTH] + "..." if len(content) > PREVIEW_LENGTH else content
+
+def note_summary(note):
+    return {
+        'id': note['id'],
+        'title': note['title'],
+        'preview': make_preview(note['content']),
+        'date': note['date'],
+        'time': note['time']
+    }
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def imported_note(note, note_id=None):
+    # При импорте заметка получает новый id, но сохраняет дату и время создания
+    now = datetime.now()
+    return {
+        'id': note_id,
+        'title': note['title'],
+        'content': note['content'],
+        'date': note.get('date') or now.strftime("%Y-%m-%d"),
+        'time': note.get('time') or now.strftime("%H:%M")
+    }
+
+def fsync_dir(path):
+    # Замена файла через os.replace переживает сбой только после fsync каталога.
+    # На Windows каталог так не открыть, там шаг пропускается
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def page_keys(order, cursor, limit):
+    end = bisect.bisect_left(order, tuple(cursor)) if cursor else len(order)
+    keys = order[max(end - limit - 1, 0):end]
+    keys.reverse()
+    return keys
+
+INSTRUMENTED_METHODS = ('load_notes', 'save_note', 'delete_note', 'search_notes', 'get_note',
+                        'load_notes_page', 'search_notes_page', 'apply_batch', 'import_notes', 'clear')
+
+def instrument_methods(cls):
+    for name in INSTRUMENTED_METHODS:
+        if name in cls.__dict__:
+            setattr(cls, name, PROFILER.timed(f"{cls.__name__}.{name}")(cls.__dict__[name]))
+
+class Storage(ABC):
+    # Каждая реализация автоматически оборачивается замерами времени
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        instrument_methods(cls)
+
+    @abstractmethod
+    def load_notes(self):
+        pass
+
+    @abstractmethod
+    def save_note(self, note):
+        pass
+
+    @abstractmethod
+    def delete_note(self, note_id):
+        pass
+
+    @abstractmethod
+    def search_notes(self, query):
+        pass
+
+    def get_note(self, note_id):
+        return next((n for n in self.load_notes() if n['id'] == note_id), None)
+
+    # Пакет операций ('save', note) / ('delete', note_id); реализации
+    # применяют его одной транзакцией или одной записью на диск
+    def apply_batch(self, operations):
+        for op, payload in operations:
+            if op == 'save':
+                self.save_note(payload)
+            else:
+                self.delete_note(payload)
+
+    # Постраничная загрузка по ключу (date, time, id) от новых к старым.
+    # Курсор - ключ последней полученной заметки, None - первая страница.
+    # Страницы содержат только сводку заметки (без content), полный текст
+    # берется через get_note.
+    def load_notes_page(self, cursor=None, limit=PAGE_SIZE):
+        return self.paginate(self.load_notes(), cursor, limit)
+
+    def search_notes_page(self, query, cursor=None, limit=PAGE_SIZE):
+        return self.paginate(self.search_notes(query), cursor, limit)
+
+    # Потоковое чтение всех заметок для экспорта и переноса между хранилищами
+    def iter_notes(self, batch_size=TRANSFER_BATCH_SIZE):
+        yield from self.load_notes()
+
+    def clear(self):
+        self.apply_batch([('delete', note['id']) for note in self.load_notes()])
+
+    def import_notes(self, notes, batch_size=TRANSFER_BATCH_SIZE, progress=None):
+        count = 0
+        for batch in batched(notes, batch_size):
+            for note in batch:
+                self.save_note({'title': note['title'], 'content': note['content']})
+            count += len(batch)
+            if progress:
+                progress(count)
+        return count
+
+    @staticmethod
+    def paginate(notes, cursor, limit):
+        notes = sorted(notes, key=note_key, reverse=True)
+        if cursor:
+            notes = [n for n in notes if note_key(n) < tuple(cursor)]
+        page = [note_summary(n) for n in notes[:limit]]
+        next_cursor = note_key(page[-1]) if len(notes) > limit else None
+        return page, next_cursor
+
+instrument_methods(Storage)
+
+class SQLiteStorage(Storage):
+    def __init__(self, db_path="notes.db"):
+        self.db_path = db_path
+        self.init_db()
+
+    def init_db(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+                       CREATE TABLE IF NOT EXISTS notes
+                       (
+                           id
+                           INTEGER
+                           PRIMARY
+                           KEY
+                           AUTOINCREMENT,
+                           title
+                           TEXT
+                           NOT
+                           NULL,
+                           content
+                           TEXT
+                           NOT
+                           NULL,
+                           date
+                           TEXT
+                           NOT
+                           NULL,
+                           time
+                           TEXT
+                           NOT
+                           NULL,
+                           preview
+                           TEXT
+                           NOT
+                           NULL
+                           DEFAULT
+                           ''
+                       )
+                       ''')
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(notes)")]
+        if 'preview' not in columns:
+            cursor.execute("ALTER TABLE notes ADD COLUMN preview TEXT NOT NULL DEFAULT ''")
+            cursor.execute('''
+                           UPDATE notes
+                           SET preview = CASE
+                                             WHEN length(content) > ? THEN substr(content, 1, ?) || '...'
+                                             ELSE content END
+                           ''', (PREVIEW_LENGTH, PREVIEW_LENGTH))
+        cursor.execute('''
+                       CREATE INDEX IF NOT EXISTS idx_notes_date_time_id
+                           ON notes (date DESC, time DESC, id DESC)
+                       ''')
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def row_to_note(row):
+        return {
+            'id': row[0],
+            'title': row[1],
+            'content': row[2],
+            'date': row[3],
+            'time': row[4]
+        }
+
+    @staticmethod
+    def row_to_summary(row):
+        return {
+            'id': row[0],
+            'title': row[1],
+            'preview': row[2],
+            'date': row[3],
+            'time': row[4]
+        }
+
+    def load_notes(self):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, title, content, date, time FROM notes ORDER BY date DESC, time DESC, id DESC")
+        notes = [self.row_to_note(row) for row in cursor.fetchall()]
+        conn.close()
+        return notes
+
+    def save_note(self, note):
+        conn = sqlite3.connect(self.db_path)
+        self.write_note(conn.cursor(), note)
+        conn.commit()
+        conn.close()
+
+    def write_note(self, cursor, note):
+        if note.get('id'):
+            cursor.execute('''
+                           UPDATE notes
+                           SET title=?,
+                               content=?,
+                               preview=?
+                           WHERE id = ?
+                           ''', (note['title'], note['content'], make_preview(note['content']), note['id']))
+        else:
+            now = datetime.now()
+            current_date = now.strftime("%Y-%m-%d")
+            current_time = now.strftime("%H:%M")
+
+            cursor.execute('''
+                           INSERT INTO notes (title, content, date, time, preview)
+                           VALUES (?, ?, ?, ?, ?)
+                           ''', (note['title'], note['content'], current_date, current_time,
+                                 make_preview(note['content'])))
+            note['id'] = cursor.lastrowid
+
+    def delete_note(self, note_id):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM notes WHERE id=?", (note_id,))
+        conn.commit()
+        conn.close()
+
+    def apply_batch(self, operations):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            with conn:
+                cursor = conn.cursor()
+                for op, payload in operations:
+                    if op == 'save':
+                        self.write_note(cursor, payload)
+                    else:
+                        cursor.execute("DELETE FROM notes WHERE id=?", (payload,))
+        finally:
+            conn.close()
+
+    def search_notes(self, query):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute('''
+                       SELECT id, title, content, date, time
+                       FROM notes
+                       WHERE title LIKE ?
+                          OR content LIKE ?
+                       ORDER BY date DESC, time DESC, id DESC
+                       ''', (f'%{query}%', f'%{query}%'))
+        notes = [self.row_to_note(row) for row in cursor.fetchall()]
+        conn.close()
+        return notes
+
+    def iter_notes(self, batch_size=TRANSFER_BATCH_SIZE):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute("SELECT id, title, content, date, time FROM notes ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self.row_to_note(row)
+        finally:
+            conn.close()
+
+    def clear(self):
+        conn = sqlite3.connect(self.db_path)
+        with conn:
+            conn.execute("DELETE FROM notes")
+        conn.close()
+
+    def import_notes(self, notes, batch_size=TRANSFER_BATCH_SIZE, progress=None):
+        conn = sqlite3.connect(self.db_path)
+        count = 0
+        try:
+            for batch in batched(notes, batch_size):
+                rows = []
+                for note in batch:
+                    note = imported_note(note)
+                    rows.append((note['title'], note['content'], note['date'], note['time'],
+                                 make_preview(note['content'])))
+                with conn:
+                    conn.executemany('''
+                                     INSERT INTO notes (title, content, date, time, preview)
+                                     VALUES (?, ?, ?, ?, ?)
+                                     ''', rows)
+                count += len(rows)
+                if progress:
+                    progress(count)
+        finally:
+            conn.close()
+        return count
+
+    def get_note(self, note_id):
+        conn = sqlite3.connect(self.db_path)
+        row = conn.execute("SELECT id, title, content, date, time FROM notes WHERE id=?", (note_id,)).fetchone()
+        conn.close()
+        return self.row_to_note(row) if row else None
+
+    def load_notes_page(self, cursor=None, limit=PAGE_SIZE):
+        return self.fetch_page([], [], cursor, limit)
+
+    def search_notes_page(self, query, cursor=None, limit=PAGE_SIZE):
+        return self.fetch_page(['(title LIKE ? OR content LIKE ?)'],
+                               [f'%{query}%', f'%{query}%'], cursor, limit)
+
+    def fetch_page(self, conditions, params, cursor, limit):
+        if cursor:
+            conditions = conditions + ['(date, time, id) < (?, ?, ?)']
+            params = params + list(cursor)
+
+        sql = "SELECT id, title, preview, date, time FROM notes"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY date DESC, time DESC, id DESC LIMIT ?"
+
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(sql, params + [limit + 1]).fetchall()
+        conn.close()
+
+        notes = [self.row_to_summary(row) for row in rows[:limit]]
+        next_cursor = note_key(notes[-1]) if len(rows) > limit else None
+        return notes, next_cursor
+
+class NoteIndex:
+    def __init__(self, notes=()):
+        self.notes = {}
+        self.lowered = {}
+        self.trigrams = {}
+        self.order = []
+        self.next_id = 1
+        for note in notes:
+            self.add(note)
+
+    @staticmethod
+    def trigrams_of(text):
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+
+    def add(self, note):
+        note_id = note['id']
+        if note_id in self.notes:
+            self.unindex(note_id)
+
+        title = note['title'].lower()
+        content = note['content'].lower()
+        self.notes[note_id] = note
+        bisect.insort(self.order, note_key(note))
+        self.lowered[note_id] = (title, content)
+        for gram in self.trigrams_of(title) | self.trigrams_of(content):
+            self.trigrams.setdefault(gram, set()).add(note_id)
+        self.next_id = max(self.next_id, note_id + 1)
+
+    def remove(self, note_id):
+        if note_id not in self.notes:
+            return
+        self.unindex(note_id)
+        del self.notes[note_id]
+
+    def unindex(self, note_id):
+        key = note_key(self.notes[note_id])
+        del self.order[bisect.bisect_left(self.order, key)]
+        title, content = self.lowered.pop(note_id)
+        for gram in self.trigrams_of(title) | self.trigrams_of(content):
+            bucket = self.trigrams[gram]
+            bucket.discard(note_id)
+            if not bucket:
+                del self.trigrams[gram]
+
+    def candidates(self, query):
+        # Для запросов короче триграммы индекс не помогает
+        if len(query) < 3:
+            return self.notes.keys()
+        buckets = []
+        for gram in self.trigrams_of(query):
+            bucket = self.trigrams.get(gram)
+            if not bucket:
+                return set()
+            buckets.append(bucket)
+        buckets.sort(key=len)
+        return buckets[0].intersection(*buckets[1:])
+
+    def search(self, query):
+        query = query.lower()
+        matches = []
+        for note_id in self.candidates(query):
+            title, content = self.lowered[note_id]
+            if query in title or query in content:
+                matches.append(self.notes[note_id])
+        matches.sort(key=lambda n: n['id'])
+        return matches
+
+    def page(self, query, cursor, limit):
+        if query is None:
+            keys = page_keys(self.order, cursor, limit)
+        else:
+            end = bisect.bisect_left(self.order, tuple(cursor)) if cursor else len(self.order)
+            query = query.lower()
+            candidates = self.candidates(query)
+            if isinstance(candidates, set) and len(candidates) * 4 < end:
+                # Узкий запрос: сортируем только кандидатов из индекса
+                keys = (note_key(self.notes[i]) for i in candidates)
+                if cursor:
+                    keys = (key for key in keys if key < tuple(cursor))
+                keys = sorted(keys, reverse=True)
+            else:
+                keys = (self.order[i] for i in range(end - 1, -1, -1))
+
+            selected = []
+            for key in keys:
+                title, content = self.lowered[key[2]]
+                if query in title or query in content:
+                    selected.append(key)
+                    if len(selected) > limit:
+                        break
+            keys = selected
+
+        notes = [note_summary(self.notes[key[2]]) for key in keys[:limit]]
+        next_cursor = note_key(notes[-1]) if len(keys) > limit else None
+        return notes, next_cursor
+
+class FileStorage(Storage):
+    def __init__(self, file_path="notes.json"):
+        self.file_path = file_path
+        self.cache = None
+        self.cache_stamp = None
+        self.init_storage()
+
+    def init_storage(self):
+        if not os.path.exists(self.file_path):
+            with open(self.file_path, 'w') as f:
+                json.dump([], f)
+
+    def file_stamp(self):
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def read_file(self):
+        try:
+            with open(self.file_path, 'r') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, FileNotFoundError):
+            return []
+
+    def write_file(self):
+        # Файл заменяется целиком: при сбое записи на диске остается прежний
+        tmp_path = self.file_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(list(self.cache.notes.values()), f, indent=2)
+        os.replace(tmp_path, self.file_path)
+        self.cache_stamp = self.file_stamp()
+
+    @contextmanager
+    def changing(self):
+        # Кэш меняется раньше файла; если изменение не записалось,
+        # кэш сбрасывается и следующее чтение идет с диска
+        try:
+            yield self.get_index()
+        except BaseException:
+            self.cache = None
+            raise
+
+    def get_index(self):
+        # Файл могли изменить снаружи, поэтому кэш сверяется с mtime и размером
+        stamp = self.file_stamp()
+        if self.cache is None or stamp != self.cache_stamp:
+            self.cache = NoteIndex(self.read_file())
+            self.cache_stamp = stamp
+        return self.cache
+
+    def load_notes(self):
+        return [dict(n) for n in self.get_index().notes.values()]
+
+    def save_note(self, note):
+        with self.changing() as index:
+            if self.put_note(index, note):
+                self.write_file()
+
+    def put_note(self, index, note):
+        if note.get('id'):
+            stored = index.notes.get(note['id'])
+            if stored is None:
+                return False
+            stored = dict(stored, title=note['title'], content=note['content'])
+        else:
+            now = datetime.now()
+            note['id'] = index.next_id
+            note['date'] = now.strftime("%Y-%m-%d")
+            note['time'] = now.strftime("%H:%M")
+            stored = dict(note)
+
+        index.add(stored)
+        return True
+
+    def delete_note(self, note_id):
+        with self.changing() as index:
+            if note_id in index.notes:
+                index.remove(note_id)
+                self.write_file()
+
+    def apply_batch(self, operations):
+        with self.changing() as index:
+            changed = False
+            for op, payload in operations:
+                if op == 'save':
+                    changed = self.put_note(index, payload) or changed
+                elif payload in index.notes:
+                    index.remove(payload)
+                    changed = True
+            if changed:
+                self.write_file()
+
+    def search_notes(self, query):
+        return [dict(n) for n in self.get_index().search(query)]
+
+    def get_note(self, note_id):
+        note = self.get_index().notes.get(note_id)
+        return dict(note) if note else None
+
+    def iter_notes(self, batch_size=TRANSFER_BATCH_SIZE):
+        # Кэш совпадает с файлом, поэтому при переносе файл читается потоком,
+        # без построения индекса
+        return iter_json_array(self.file_path)
+
+    def clear(self):
+        with self.changing():
+            self.cache = NoteIndex()
+            self.write_file()
+
+    def import_notes(self, notes, batch_size=TRANSFER_BATCH_SIZE, progress=None):
+        # Прежние и новые заметки потоком пишутся в новый файл. Индекс с
+        # триграммами при этом не строится, он соберется при первом чтении
+        count = 0
+
+        def merged():
+            nonlocal count
+            last_id = 0
+            for note in iter_json_array(self.file_path):
+                last_id = max(last_id, note['id'])
+                yield note
+            for note in notes:
+                last_id += 1
+                count += 1
+                yield imported_note(note, last_id)
+                if progress and count % batch_size == 0:
+                    progress(count)
+
+        try:
+            write_json_array(self.file_path, merged())
+        finally:
+            self.cache = None
+        if progress:
+            progress(count)
+        return count
+
+    def load_notes_page(self, cursor=None, limit=PAGE_SIZE):
+        return self.get_index().page(None, cursor, limit)
+
+    def search_notes_page(self, query, cursor=None, limit=PAGE_SIZE):
+        return self.get_index().page(query, cursor, limit)
+
+class JournalStorage(Storage):
+    COMPACT_MIN_RECORDS = 200
+
+    def __init__(self, file_path="notes.journal"):
+        self.file_path = file_path
+        self.index = {}
+        self.summaries = {}
+        self.order = []
+        self.next_id = 1
+        self.dead_records = 0
+        self.init_storage()
+
+    def init_storage(self):
+        if not os.path.exists(self.file_path):
+            open(self.file_path, 'wb').close()
+        self.replay()
+
+    def replay(self):
+        self.index = {}
+        self.summaries = {}
+        self.order = []
+        self.next_id = 1
+        self.dead_records = 0
+
+        offset = 0
+        with open(self.file_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self.apply_record(record, offset)
+                offset += len(line)
+
+        # Хвост, оборванный при сбое посреди записи, отбрасываем
+        if offset != os.path.getsize(self.file_path):
+            with open(self.file_path, 'r+b') as f:
+                f.truncate(offset)
+
+    def apply_record(self, record, offset):
+        op = record['op']
+        if op == 'seq':
+            self.next_id = max(self.next_id, record['next_id'])
+        elif op == 'put':
+            note_id = record['note']['id']
+            if note_id in self.index:
+                self.forget(note_id)
+                self.dead_records += 1
+            self.index[note_id] = offset
+            self.summaries[note_id] = note_summary(record['note'])
+            bisect.insort(self.order, note_key(record['note']))
+            self.next_id = max(self.next_id, note_id + 1)
+        elif op == 'del':
+            if record['id'] in self.index:
+                self.forget(record['id'])
+                self.dead_records += 1
+            self.dead_records += 1
+
+    def forget(self, note_id):
+        del self.index[note_id]
+        summary = self.summaries.pop(note_id)
+        del self.order[bisect.bisect_left(self.order, note_key(summary))]
+
+    def append_record(self, record):
+        self.append_records([record])
+
+    def append_records(self, records):
+        lines = [json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n' for record in records]
+        data = memoryview(b''.join(lines))
+        # Без буфера: после ошибки в буфере не останется хвоста, который
+        # допишется при закрытии поверх обрезанного журнала
+        with open(self.file_path, 'ab', buffering=0) as f:
+            offset = f.seek(0, os.SEEK_END)
+            try:
+                written = 0
+                while written < len(data):
+                    written += f.write(data[written:])
+                os.fsync(f.fileno())
+            except BaseException:
+                # Оборванная строка остановила бы replay, и следующие за ней
+                # подтвержденные записи были бы отброшены
+                os.ftruncate(f.fileno(), offset)
+                raise
+        for record, line in zip(records, lines):
+            self.apply_record(record, offset)
+            offset += len(line)
+
+    def read_note(self, f, offset):
+        f.seek(offset)
+        return json.loads(f.readline())['note']
+
+    def get_note(self, note_id):
+        if note_id not in self.index:
+            return None
+        with open(self.file_path, 'rb') as f:
+            return self.read_note(f, self.index[note_id])
+
+    def iter_notes(self, batch_size=TRANSFER_BATCH_SIZE):
+        # Индекс упорядочен по смещению, поэтому журнал читается последовательно
+        offsets = list(self.index.values())
+        with open(self.file_path, 'rb') as f:
+            for offset in offsets:
+                yield self.read_note(f, offset)
+
+    def clear(self):
+        # Пустой журнал записывается так же, как при сжатии: через временный файл
+        self.index = {}
+        self.summaries = {}
+        self.order = []
+        self.compact()
+
+    def import_notes(self, notes, batch_size=TRANSFER_BATCH_SIZE, progress=None):
+        count = 0
+        for batch in batched(notes, batch_size):
+            records = []
+            for note in batch:
+                records.append({'op': 'put', 'note': imported_note(note, self.next_id)})
+                self.next_id += 1
+            self.append_records(records)
+            count += len(records)
+            if progress:
+                progress(count)
+        return count
+
+    def load_notes_page(self, cursor=None, limit=PAGE_SIZE):
+        keys = page_keys(self.order, cursor, limit)
+        notes = [self.summaries[key[2]] for key in keys[:limit]]
+        next_cursor = note_key(notes[-1]) if len(keys) > limit else None
+        return [dict(n) for n in notes], next_cursor
+
+    def load_notes(self):
+        with open(self.file_path, 'rb') as f:
+            notes = [self.read_note(f, offset) for offset in self.index.values()]
+        notes.sort(key=note_key, reverse=True)
+        return notes
+
+    def save_note(self, note):
+        record = self.note_record(note)
+        if record:
+            self.append_record(record)
+            self.maybe_compact()
+
+    def note_record(self, note):
+        if note.get('id'):
+            if note['id'] not in self.index:
+                return None
+            with open(self.file_path, 'rb') as f:
+                stored = self.read_note(f, self.index[note['id']])
+            stored['title'] = note['title']
+            stored['content'] = note['content']
+        else:
+            now = datetime.now()
+            note['id'] = self.next_id
+            self.next_id += 1
+            stored = {
+                'id': note['id'],
+                'title': note['title'],
+                'content': note['content'],
+                'date': now.strftime("%Y-%m-%d"),
+                'time': now.strftime("%H:%M")
+            }
+
+        return {'op': 'put', 'note': stored}
+
+    def delete_note(self, note_id):
+        if note_id not in self.index:
+            return
+        self.append_record({'op': 'del', 'id': note_id})
+        self.maybe_compact()
+
+    def apply_batch(self, operations):
+        records = []
+        for op, payload in operations:
+            if op == 'save':
+                record = self.note_record(payload)
+            else:
+                record = {'op': 'del', 'id': payload} if payload in self.index else None
+            if record:
+                records.append(record)
+        if records:
+            self.append_records(records)
+            self.maybe_compact()
+
+    def search_notes(self, query):
+        notes = self.load_notes()
+        return [n for n in notes if query.lower() in n['title'].lower() or
+                query.lower() in n['content'].lower()]
+
+    def maybe_compact(self):
+        if self.dead_records >= self.COMPACT_MIN_RECORDS and self.dead_records > len(self.index):
+            self.compact()
+
+    def compact(self):
+        tmp_path = self.file_path + '.tmp'
+        index = {}
+        with open(self.file_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            dst.write(json.dumps({'op': 'seq', 'next_id': self.next_id}).encode('utf-8') + b'\n')
+            for note_id, offset in self.index.items():
+                src.seek(offset)
+                index[note_id] = dst.tell()
+                dst.write(src.readline())
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_path, self.file_path)
+        fsync_dir(self.file_path)
+        self.index = index
+        self.dead_records = 0
+
+def write_json_array(path, notes, progress=None):
+    # Заметки пишутся по одной через временный файл, весь массив в памяти не собирается
+    tmp_path = path + '.tmp'
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for note in notes:
+            f.write(',\n' if count else '\n')
+            f.write(json.dumps(note, ensure_ascii=False))
+            count += 1
+            if progress and count % TRANSFER_BATCH_SIZE == 0:
+                progress(count)
+        f.write('\n]\n')
+    os.replace(tmp_path, path)
+    if progress:
+        progress(count)
+    return count
+
+def export_notes(storage, path, progress=None):
+    return write_json_array(path, storage.iter_notes(), progress)
+
+def iter_json_array(path, chunk_size=64 * 1024):
+    # Читает JSON-массив объектов по частям, не загружая файл целиком
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        started = False
+        eof = False
+        while True:
+            buffer = buffer.lstrip()
+            if buffer:
+                if not started:
+                    if buffer[0] != '[':
+                        raise ValueError("Ожидался JSON-массив заметок")
+                    buffer = buffer[1:]
+                    started = True
+                    continue
+                if buffer[0] == ']':
+                    return
+                if buffer[0] == ',':
+                    buffer = buffer[1:]
+                    continue
+                try:
+                    note, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    if eof:
+                        raise
+                else:
+                    yield note
+                    buffer = buffer[end:]
+                    continue
+            if eof:
+                raise ValueError("Неожиданный конец файла")
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+
+def import_notes_file(storage, path, progress=None):
+    return storage.import_notes(iter_json_array(path), progress=progress)
+
+def migrate_notes(source, target, progress=None):
+    # Перенос, а не копирование: иначе каждый перенос туда и обратно удваивал бы
+    # заметки. Целевое хранилище должно быть пустым, исходное очищается только
+    # после успешного импорта, так что при сбое заметки остаются в источнике.
+    if target.load_notes_page(limit=1)[0]:
+        raise ValueError("В целевом хранилище уже есть заметки")
+    count = target.import_notes(source.iter_notes(), progress=progress)
+    source.clear()
+    return count
+
+class WriteBehindQueue:
+    # Отложенная запись: UI ставит изменения в очередь и сразу продолжает работу,
+    # фоновый поток схлопывает их по id заметки и сохраняет пакетами.
+    # Новые заметки до получения id различаются по самому объекту словаря,
+    # поэтому для повторных правок UI должен передавать тот же словарь.
+    # Чтения тоже выполняет фоновый поток, после уже поставленных записей,
+    # поэтому UI никогда не ждет хранилище и видит свои правки.
+
+    def __init__(self, storage, on_error=None):
+        self.storage = storage
+        self.on_error = on_error
+        self.pending = {}
+        self.in_flight = {}
+        self.reads = deque()
+        self.busy = False
+        self.closing = False
+        self.condition = threading.Condition()
+        self.storage_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def key(note):
+        return note['id'] if note.get('id') else ('new', id(note))
+
+    def save(self, note):
+        with self.condition:
+            self.pending[self.key(note)] = ('save', note)
+            self.condition.notify_all()
+
+    def delete(self, note):
+        with self.condition:
+            key = self.key(note)
+            if isinstance(key, tuple) and key not in self.in_flight:
+                # Заметка так и не дошла до хранилища
+                self.pending.pop(key, None)
+                return
+            self.pending[key] = ('delete', note)
+            self.condition.notify_all()
+
+    # callback(result, error) вызывается из фонового потока
+    def read(self, func, callback):
+        with self.condition:
+            self.reads.append((func, callback))
+            self.condition.notify_all()
+
+    def fetch_note(self, note, callback):
+        with self.condition:
+            key = self.key(note)
+            entry = self.pending.get(key) or self.in_flight.get(key)
+        if entry:
+            op, stored = entry
+            callback(dict(stored, id=note.get('id')) if op == 'save' else None, None)
+        elif not note.get('id'):
+            callback(None, None)
+        else:
+            note_id = note['id']
+            self.read(lambda storage: storage.get_note(note_id), callback)
+
+    def flush(self):
+        with self.condition:
+            while self.pending or self.reads or self.busy:
+                self.condition.wait()
+
+    def close(self):
+        # Не блокирует: поток допишет очередь и завершится сам
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+
+    def stop(self):
+        self.close()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.reads and not self.closing:
+                    self.condition.wait()
+                if not self.pending and not self.reads:
+                    return
+                self.busy = True
+                if self.pending:
+                    taken, operations = self.take_pending()
+                    read = None
+                else:
+                    read = self.reads.popleft()
+
+            if read:
+                self.run_read(*read)
+                with self.condition:
+                    self.busy = False
+                    self.condition.notify_all()
+            else:
+                self.write_batch(taken, operations)
+
+    def run_read(self, func, callback):
+        result = error = None
+        try:
+            with self.storage_lock:
+                result = func(self.storage)
+        except Exception as e:
+            error = e
+        callback(result, error)
+
+    def take_pending(self):
+        # Вызывается под condition. Снимок содержимого: UI может менять
+        # словари, пока идет запись
+        taken = self.pending
+        self.pending = {}
+        self.in_flight = {}
+        operations = []
+        for key, (op, note) in taken.items():
+            if op == 'save':
+                snapshot = {'id': note.get('id'), 'title': note['title'], 'content': note['content']}
+                self.in_flight[key] = ('save', snapshot)
+                operations.append(('save', snapshot))
+            else:
+                self.in_flight[key] = ('delete', note)
+                operations.append(('delete', note['id']))
+        return taken, operations
+
+    def write_batch(self, taken, operations):
+        error = None
+        try:
+            with self.storage_lock:
+                self.storage.apply_batch(operations)
+        except Exception as e:
+            error = e
+
+        with self.condition:
+            # При ошибке пакет откатан и не повторяется: id из снимков
+            # (например, lastrowid откатанной вставки) в UI не попадают,
+            # а UI по on_error перечитывает список из хранилища
+            if error is None:
+                for key, (op, note) in taken.items():
+                    if op == 'save' and isinstance(key, tuple) and self.in_flight[key][1].get('id'):
+                        note['id'] = self.in_flight[key][1]['id']
+                        # Правки, пришедшие во время вставки, становятся обновлением по id
+                        entry = self.pending.pop(key, None)
+                        if entry:
+                            self.pending[note['id']] = entry
+            self.in_flight = {}
+            self.busy = False
+            self.condition.notify_all()
+
+        if error and self.on_error:
+            self.on_error(error)